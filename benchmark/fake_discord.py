@@ -0,0 +1,325 @@
+import asyncio
+import contextvars
+import importlib
+import itertools
+import re
+import threading
+import time
+from datetime import datetime, timezone
+import discord
+from discord.ext import commands
+
+# The event being handled by the current task, so replies can be attributed to the message that caused them
+current_event = contextvars.ContextVar("current_event", default=None)
+
+_ids = itertools.count(1_000_000_000_000_000)
+
+def next_id():
+    return next(_ids)
+
+def mark_output():
+    """Records the first outgoing reply, send or playback for the current event."""
+    event = current_event.get()
+    if event is not None and event.first_output is None:
+        event.first_output = time.perf_counter()
+
+def check_content(content, kwargs):
+    """Rejects what Discord would: messages over 2000 characters, or empty ones with nothing attached."""
+    if len(content or "") > 2000 or not (content or kwargs.get("embed") or kwargs.get("embeds") or kwargs.get("file") or kwargs.get("files") or kwargs.get("view")):
+        raise ValueError(f"Discord rejects a message of {len(content or '')} characters")
+
+# Joins/leaves waiting for their welcome/goodbye, by the mention and the name a greeting would contain
+pending_greetings = {}
+
+def expect_greeting(member, event):
+    pending_greetings[member.mention] = event
+    pending_greetings[member.name] = event
+
+def mark_greeted(content):
+    """Records the first message that mentions or names each waiting join/leave, since one message answers a whole batch."""
+    now = time.perf_counter()
+    greeted = {pending_greetings[token] for token in pending_greetings if re.search(rf"(?<!\w){re.escape(token)}(?!\w)", content)}
+    for event in greeted:
+        event.greeted = now
+        if event.first_output is None:
+            event.first_output = now
+    for token in [token for token, event in pending_greetings.items() if event in greeted]:
+        del pending_greetings[token]
+
+class Event:
+    def __init__(self, kind):
+        self.kind = kind
+        self.started = None
+        self.first_output = None
+        self.first_audio = None
+        self.greeted = None
+        self.finished = None
+        self.error = None
+
+class FakeUser:
+    def __init__(self, name, id=None, bot=False):
+        self.id = id or next_id()
+        self.name = name
+        self.display_name = name
+        self.global_name = name
+        self.bot = bot
+        self.voice = None
+        self.mention = f"<@{self.id}>"
+        self.timeouts = 0
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def timeout(self, duration, reason=None):
+        self.timeouts += 1
+
+class FakeAttachment:
+    def __init__(self, url, filename="image.png", content_type="image/png"):
+        self.url = url
+        self.filename = filename
+        self.content_type = content_type
+
+class FakeTyping:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+class FakeChannel:
+    def __init__(self, guild, name="general", history_size=500):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.mention = f"<#{self.id}>"
+        self.history_size = history_size
+        self.messages = []
+        self.sent = 0
+
+    def typing(self):
+        return FakeTyping(self)
+
+    def log(self, message):
+        self.messages.append(message)
+        if len(self.messages) > self.history_size:
+            del self.messages[:len(self.messages) - self.history_size]
+
+    async def history(self, limit=100, before=None):
+        # Newest first, like discord.py
+        count = 0
+        for message in reversed(self.messages):
+            if before is not None and message.id >= before.id:
+                continue
+            if count >= limit:
+                break
+            count += 1
+            yield message
+
+    async def send(self, content=None, **kwargs):
+        check_content(content, kwargs)
+        mark_output()
+        mark_greeted(content or "")
+        self.sent += 1
+        message = FakeMessage(self.guild.me if self.guild else None, self, content or "")
+        self.log(message)
+        return message
+
+class FakeVoiceClient:
+    """
+    Accepts audio sources and drains them in a thread instead of sending them to Discord.
+    Audio frames are read as fast as possible, silence frames are paced at 20ms like the real player.
+    """
+    SILENCE = b"\x00" * discord.opus.Encoder.FRAME_SIZE
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.played = 0
+        self.silence_frames = 0
+        self._playing = None
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return self._playing is not None and self._playing.is_alive()
+
+    async def disconnect(self):
+        self.channel.guild.voice_client = None
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    def stop(self):
+        pass
+
+    def play(self, source, *, after=None):
+        if self.is_playing():
+            raise discord.ClientException("Already playing audio.")
+        mark_output()
+        event = current_event.get()
+        if event is not None and event.first_audio is None:
+            event.first_audio = time.perf_counter()
+        self.played += 1
+        def _drain():
+            error = None
+            try:
+                while frame := source.read():
+                    if frame == self.SILENCE:
+                        self.silence_frames += 1
+                        time.sleep(discord.player.AudioPlayer.DELAY)
+            except Exception as e:
+                error = e
+            finally:
+                source.cleanup()
+            if after:
+                after(error)
+        self._playing = threading.Thread(target=_drain, daemon=True)
+        self._playing.start()
+
+class FakeRawMemberRemoveEvent:
+    def __init__(self, user, guild_id):
+        self.user = user
+        self.guild_id = guild_id
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+
+class FakeGuild:
+    def __init__(self, client, name="Benchmark Guild", id=None):
+        self.id = id or next_id()
+        self.name = name
+        self.shard_id = 0
+        self.me = client.user
+        self.members = {}
+        self.voice_client = None
+        self.system_channel = FakeChannel(self, "system")
+        self.channels = [self.system_channel]
+
+    def add_member(self, member):
+        self.members[member.id] = member
+        return member
+
+    def get_member(self, id):
+        return self.members.get(id)
+
+    def remove_member(self, id):
+        return self.members.pop(id, None)
+
+    def create_channel(self, name):
+        channel = FakeChannel(self, name)
+        self.channels.append(channel)
+        return channel
+
+class FakeMessage:
+    def __init__(self, author, channel, content, mentions=(), attachments=(), type=discord.MessageType.default):
+        self.id = next_id()
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild if channel else None
+        self.content = content
+        self.mentions = list(mentions)
+        self.attachments = list(attachments)
+        self.type = type
+        self.created_at = datetime.now(timezone.utc)
+
+    async def reply(self, content=None, **kwargs):
+        check_content(content, kwargs)
+        mark_output()
+        mark_greeted(content or "")
+        message = FakeMessage(self.guild.me if self.guild else None, self.channel, content or "")
+        if self.channel is not None:
+            self.channel.sent += 1
+            self.channel.log(message)
+        return message
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+    async def send_message(self, content=None, **kwargs):
+        mark_output()
+        self._done = True
+
+class FakeFollowup:
+    async def send(self, content=None, **kwargs):
+        check_content(content, kwargs)
+        mark_output()
+
+class FakeInteraction:
+    def __init__(self, client, user, channel):
+        self.client = client
+        self.user = user
+        self.channel = channel
+        self.guild = channel.guild
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup()
+
+    async def edit_original_response(self, content=None, **kwargs):
+        mark_output()
+
+class FakeClient:
+    """Just enough of commands.Bot for the cogs: identity, guilds, extensions and a cog registry."""
+    def __init__(self, main_name):
+        self.main_name = main_name
+        self.user = FakeUser(main_name, bot=True)
+        self.guilds = []
+        self.cogs = {}
+        self.extensions = {}
+        self.latency = 0.0
+
+    async def add_cog(self, cog):
+        await cog.cog_load()
+        self.cogs[cog.__cog_name__] = cog
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+    def get_guild(self, id):
+        return next((guild for guild in self.guilds if guild.id == id), None)
+
+    async def load_extension(self, name):
+        if name in self.extensions:
+            raise commands.ExtensionAlreadyLoaded(name)
+        module = importlib.import_module(name)
+        await module.setup(self)
+        self.extensions[name] = module
+
+    async def unload_extension(self, name):
+        self.extensions.pop(name)
+        for cog_name, cog in list(self.cogs.items()):
+            if cog.__module__ == name:
+                await cog.cog_unload()
+                del self.cogs[cog_name]
+
+    async def reload_extension(self, name):
+        module = self.extensions[name]
+        await self.unload_extension(name)
+        module = importlib.reload(module)
+        await module.setup(self)
+        self.extensions[name] = module
+
+    async def dispatch(self, event_name, *args):
+        """Runs every cog listener for an event and waits for them, the way discord.py schedules them."""
+        listeners = []
+        for cog in self.cogs.values():
+            for name, method in cog.get_listeners():
+                if name == f"on_{event_name}":
+                    listeners.append(method(*args))
+        results = await asyncio.gather(*listeners, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
@@ -0,0 +1,168 @@
+import asyncio
+import base64
+import random
+import re
+import threading
+from io import BytesIO
+from aiohttp import web
+from PIL import Image
+
+class FakeGemini:
+    """
+    Minimal stand-in for the Gemini REST API, served from a background thread.
+    Answers generateContent for both text and TTS models with configurable
+    latency and error rate, implements enough of cachedContents for context caching
+    and serves a PNG at /image.png for attachment URLs.
+    """
+    def __init__(self, latency_ms=800, jitter_ms=200, error_rate=0.0, tts_ms_per_char=20, cache_min_tokens=0, reply_sentences=4, host="127.0.0.1", port=0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.tts_ms_per_char = tts_ms_per_char
+        self.cache_min_tokens = cache_min_tokens
+        self.reply_sentences = reply_sentences
+        self.host = host
+        self.port = port
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        # Input tokens sent over the wire vs. served from a cached content, for text generation requests
+        self.text_requests = 0
+        self.uploaded_tokens = 0
+        self.cached_tokens = 0
+        self.caches = {}
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+        img = Image.new("RGB", (512, 512), (90, 120, 200))
+        buffer = BytesIO()
+        img.save(buffer, format="PNG")
+        self.png = buffer.getvalue()
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        started = threading.Event()
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start_server())
+            started.set()
+            self._loop.run_forever()
+        self._thread = threading.Thread(target=_run, name="fake-gemini", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    async def _start_server(self):
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        app.router.add_post("/{version}/models/{model}:generateContent", self.generate_content)
+        app.router.add_post("/{version}/cachedContents", self.create_cache)
+        app.router.add_patch("/{version}/cachedContents/{id}", self.update_cache)
+        app.router.add_get("/image.png", self.image)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def _delay(self, extra_ms=0):
+        delay = self.latency_ms + extra_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        await asyncio.sleep(max(delay, 0) / 1000)
+
+    def _error(self):
+        self.errors += 1
+        return web.json_response({"error": {"code": 500, "message": "Fake Gemini error", "status": "INTERNAL"}}, status=500)
+
+    async def image(self, request):
+        return web.Response(body=self.png, content_type="image/png")
+
+    async def create_cache(self, request):
+        body = await request.json()
+        tokens = count_tokens(body.get("systemInstruction", {})) + sum(count_tokens(content) for content in body.get("contents", []))
+        if tokens < self.cache_min_tokens:
+            return web.json_response({"error": {"code": 400, "message": f"Cached content is too small. total_token_count={tokens}, min_total_token_count={self.cache_min_tokens}", "status": "INVALID_ARGUMENT"}}, status=400)
+        name = f"cachedContents/fake{len(self.caches)}"
+        self.caches[name] = tokens
+        return web.json_response({"name": name, "model": body.get("model"), "usageMetadata": {"totalTokenCount": tokens}})
+
+    async def update_cache(self, request):
+        name = f"cachedContents/{request.match_info['id']}"
+        if name not in self.caches:
+            return web.json_response({"error": {"code": 404, "message": f"{name} not found", "status": "NOT_FOUND"}}, status=404)
+        return web.json_response({"name": name, "usageMetadata": {"totalTokenCount": self.caches[name]}})
+
+    async def generate_content(self, request):
+        self.requests += 1
+        body = await request.json()
+        model = request.match_info["model"]
+        text = prompt_text(body)
+
+        if "tts" in model:
+            await self._delay(len(text) * self.tts_ms_per_char)
+            if self.random.random() < self.error_rate:
+                return self._error()
+            # 24kHz mono s16le, roughly 60ms of audio per character, as a quiet square wave so it can be told apart from silence
+            pcm = (b"\x00\x04" * 24 + b"\x00\xfc" * 24) * (int(len(text) * 0.06 * 24000) // 48)
+            part = {"inlineData": {"mimeType": "audio/L16;codec=pcm;rate=24000", "data": base64.b64encode(pcm).decode()}}
+            usage = {"promptTokenCount": len(text) // 4}
+        else:
+            cached_tokens = 0
+            if "cachedContent" in body:
+                if body["cachedContent"] not in self.caches:
+                    return web.json_response({"error": {"code": 404, "message": f"{body['cachedContent']} not found", "status": "NOT_FOUND"}}, status=404)
+                cached_tokens = self.caches[body["cachedContent"]]
+            uploaded_tokens = count_tokens(body.get("systemInstruction", {})) + sum(count_tokens(content) for content in body.get("contents", []))
+            await self._delay()
+            if self.random.random() < self.error_rate:
+                return self._error()
+            self.text_requests += 1
+            self.uploaded_tokens += uploaded_tokens
+            self.cached_tokens += cached_tokens
+            part = {"text": "Message: " + " ".join(REPLY_SENTENCES[i % len(REPLY_SENTENCES)] for i in range(self.reply_sentences))}
+            # Greet joins/leaves by name like the real model, templates get the NEW_USER_NAME placeholder back
+            names = re.search(r"(?:New User Name|User that left name): (.*)", text)
+            if names:
+                part["text"] += f" Say hi to {names.group(1)}!"
+            usage = {"promptTokenCount": uploaded_tokens + cached_tokens, "cachedContentTokenCount": cached_tokens}
+
+        usage["candidatesTokenCount"] = 32
+        usage["totalTokenCount"] = usage["promptTokenCount"] + 32
+        return web.json_response({
+            "candidates": [{"content": {"role": "model", "parts": [part]}, "finishReason": "STOP"}],
+            "usageMetadata": usage,
+        })
+
+REPLY_SENTENCES = [
+    "This is a fake reply.",
+    "It has a few sentences!",
+    "Does it read well?",
+    "It should be long enough to be spoken.",
+]
+
+def count_tokens(content):
+    # Roughly 4 characters per text token, images are billed at a flat 258 tokens
+    tokens = 0
+    for part in content.get("parts", []):
+        tokens += len(part.get("text", "")) // 4
+        if "inlineData" in part:
+            tokens += 258
+    return tokens
+
+def prompt_text(body):
+    text = ""
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            text += part.get("text", "")
+    return text
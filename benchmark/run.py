@@ -0,0 +1,398 @@
+"""
+Offline load test for the message pipeline.
+
+Drives the real cogs with fake Discord objects against a local fake Gemini server
+and reports throughput, reply latency, event loop lag and memory. Run from the repo root:
+
+    python -m benchmark.run --scenario mention_storm --duration 30 --output storm.json
+    python -m benchmark.run --scenario mention_storm --baseline storm.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import discord
+from discord import app_commands
+from benchmark.fake_gemini import FakeGemini
+from benchmark.fake_discord import Event, FakeAttachment, FakeClient, FakeGuild, FakeInteraction, FakeMessage, FakeRawMemberRemoveEvent, FakeUser, FakeVoiceClient, FakeVoiceState, current_event, expect_greeting
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_NAME = "Bot"
+COGS = ["startup", "AI", "voice", "commands"]
+
+SENTENCES = [
+    "Has anyone tried the new patch yet?",
+    "I think the boss fight is way too hard.",
+    "Can someone explain how the crafting system works?",
+    "Lol that clip was hilarious.",
+    "What time is the event tonight?",
+    "My internet keeps dropping during raids.",
+]
+
+def quiet_event(rng):
+    return {"kind": "message", "channel": "general", "mention": rng.random() < 0.05, "content": rng.choice(SENTENCES)}
+
+def mention_storm_event(rng):
+    return {"kind": "message", "channel": "general", "mention": True, "content": rng.choice(SENTENCES)}
+
+def image_history_event(rng):
+    return {"kind": "message", "channel": "general", "mention": True, "images": 1, "content": rng.choice(SENTENCES)}
+
+def tts_burst_event(rng):
+    if rng.random() < 0.7:
+        return {"kind": "message", "channel": "voice", "mention": False, "content": f"~ {rng.choice(SENTENCES)}"}
+    return {"kind": "message", "channel": "voice", "mention": True, "content": rng.choice(SENTENCES)}
+
+def voice_reply_event(rng):
+    return {"kind": "message", "channel": "voice", "mention": True, "content": rng.choice(SENTENCES)}
+
+def join_wave_event(rng):
+    if rng.random() < 0.8:
+        return {"kind": "join"}
+    # Uncached leavers only get the raw event, like with lazy_member_cache
+    return {"kind": "leave", "cached": rng.random() < 0.5}
+
+def reload_event(rng):
+    # Mention traffic with a /reload cogs every ~2 seconds, after touching AI.py, prompts.json or nothing
+    if rng.random() < 0.05:
+        return {"kind": "reload", "touch": rng.choice(["cogs/AI.py", "Variables/prompts.json", None])}
+    return mention_storm_event(rng)
+
+def commands_event(rng):
+    if rng.random() < 0.5:
+        return {"kind": "command", "name": "help"}
+    return {"kind": "command", "name": "message", "content": rng.choice(SENTENCES)}
+
+# name: (default rate in events/sec, event factory, seeded history size, share of seeded history with an image)
+SCENARIOS = {
+    "quiet": (0.5, quiet_event, 100, 0.0),
+    "mention_storm": (20, mention_storm_event, 250, 0.0),
+    "image_history": (2, image_history_event, 250, 0.5),
+    "tts_burst": (5, tts_burst_event, 50, 0.0),
+    "voice_reply": (0.2, voice_reply_event, 20, 0.0),
+    "join_wave": (20, join_wave_event, 0, 0.0),
+    "commands": (10, commands_event, 50, 0.0),
+    "reload": (10, reload_event, 50, 0.0),
+}
+
+def synthetic_traffic(scenario, rate, duration, seed):
+    default_rate, factory, _, _ = SCENARIOS[scenario]
+    rate = rate or default_rate
+    rng = random.Random(seed)
+    traffic = []
+    for i in range(max(int(rate * duration), 1)):
+        spec = factory(rng)
+        spec["t"] = round(i / rate, 4)
+        spec["user"] = rng.randrange(50)
+        traffic.append(spec)
+    return traffic
+
+def load_traffic(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_traffic(traffic, path):
+    with open(path, "w") as f:
+        for spec in traffic:
+            f.write(json.dumps(spec) + "\n")
+
+def prepare_workdir(fake, history_limit, context_caching, tts_pipelining):
+    """Builds a throwaway copy of the Variables/config layout the cogs load from, pointed at the fake server."""
+    workdir = tempfile.mkdtemp(prefix="discordbot-bench-")
+    # The cogs are copied too, so /reload can hash them and the reload scenario can change them
+    for folder in ["cogs", "scripts"]:
+        shutil.copytree(os.path.join(REPO_ROOT, folder), os.path.join(workdir, folder), ignore=shutil.ignore_patterns("__pycache__"))
+    os.makedirs(os.path.join(workdir, "Variables"))
+    os.makedirs(os.path.join(workdir, "config", BOT_NAME))
+    os.makedirs(os.path.join(workdir, "config", "voice"))
+    for file in ["default_config.json", "default_voice.json"]:
+        shutil.copy2(os.path.join(REPO_ROOT, "config", file), os.path.join(workdir, "config", file))
+
+    with open(os.path.join(REPO_ROOT, "Variables", "general.json")) as f:
+        general = json.load(f)
+    general["ai_studio_base_url"] = fake.base_url
+    general["Bots"] = [BOT_NAME]
+    general.setdefault(BOT_NAME, {"nicknames": []})
+    if history_limit is not None:
+        general["ai_message_history_limit"] = history_limit
+    general["ai_studio_context_caching"] = context_caching
+    general["tts_pipelining"] = tts_pipelining
+
+    prompts_path = os.path.join(REPO_ROOT, "Variables", "prompts.json")
+    if not os.path.exists(prompts_path):
+        prompts_path = os.path.join(REPO_ROOT, "Variables", "prompts.EXAMPLE.json")
+    with open(prompts_path) as f:
+        prompts = json.load(f)
+    prompts.setdefault(BOT_NAME, next(v for v in prompts.values() if isinstance(v, dict)))
+
+    for name, data in [("general", general), ("prompts", prompts), ("keys", {BOT_NAME: {"client_key": "fake"}, "ai_studio_key": "fake"})]:
+        with open(os.path.join(workdir, "Variables", f"{name}.json"), "w") as f:
+            json.dump(data, f, indent=4)
+    return workdir
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class Bench:
+    def __init__(self, fake, guild_count, seed):
+        self.fake = fake
+        self.rng = random.Random(seed)
+        self.client = FakeClient(BOT_NAME)
+        self.guild_count = guild_count
+        self.events = []
+        self.loop_lag = []
+        self.rss_samples = []
+        self.startup_seconds = None
+
+    async def load_cogs(self):
+        for i in range(self.guild_count):
+            self.client.guilds.append(FakeGuild(self.client, f"Guild {i}"))
+        self.guild = self.client.guilds[0]
+        self.general = self.guild.create_channel("general")
+        self.voice = self.guild.create_channel("voice")
+        self.guild.voice_client = FakeVoiceClient(self.voice)
+        self.users = [self.guild.add_member(FakeUser(f"User{i}")) for i in range(50)]
+
+        start = time.perf_counter()
+        for cog in COGS:
+            await self.client.load_extension(f"cogs.{cog}")
+        self.startup_seconds = time.perf_counter() - start
+
+        # Same bookkeeping as bot.py, so /reload knows what is unchanged
+        functions = sys.modules["scripts.functions"]
+        for cog in COGS:
+            functions.cog_hashes(self.client)[f"cogs.{cog}"] = functions.extension_hash(self.client, f"cogs.{cog}")
+        functions.cog_hashes(self.client)["scripts.functions"] = functions.extension_hash(self.client, "scripts.functions")
+
+    def seed_history(self, size, image_share):
+        for i in range(size):
+            author = self.users[i % len(self.users)]
+            attachments = [FakeAttachment(f"{self.fake.base_url}/image.png")] if self.rng.random() < image_share else []
+            for channel in (self.general, self.voice):
+                channel.log(FakeMessage(author, channel, self.rng.choice(SENTENCES), attachments=attachments))
+
+    async def sample_loop(self, interval=0.05):
+        while True:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(time.perf_counter() - expected, 0))
+            self.rss_samples.append(rss_mb())
+
+    async def handle(self, spec):
+        event = Event(spec["kind"])
+        current_event.set(event)
+        self.events.append(event)
+        user = self.users[spec.get("user", 0) % len(self.users)]
+        event.started = time.perf_counter()
+        try:
+            if spec["kind"] == "message":
+                channel = self.voice if spec.get("channel") == "voice" else self.general
+                user.voice = FakeVoiceState(self.voice) if channel is self.voice else None
+                content = spec.get("content", "")
+                mentions = []
+                if spec.get("mention"):
+                    content = f"{self.client.user.mention} {content}"
+                    mentions = [self.client.user]
+                attachments = [FakeAttachment(f"{self.fake.base_url}/image.png") for _ in range(spec.get("images", 0))]
+                message = FakeMessage(user, channel, content, mentions=mentions, attachments=attachments)
+                channel.log(message)
+                await self.client.dispatch("message", message)
+            elif spec["kind"] == "join":
+                member = self.guild.add_member(FakeUser(f"Newcomer{len(self.events)}"))
+                expect_greeting(member, event)
+                message = FakeMessage(member, self.guild.system_channel, "", type=discord.MessageType.new_member)
+                self.guild.system_channel.log(message)
+                await self.client.dispatch("message", message)
+            elif spec["kind"] == "leave":
+                # Same as discord.py: raw_member_remove always, member_remove only if the member was cached
+                cached = self.guild.remove_member(user.id) if spec.get("cached") else None
+                member = cached or FakeUser(f"Leaver{len(self.events)}")
+                member.guild = self.guild
+                expect_greeting(member, event)
+                await self.client.dispatch("raw_member_remove", FakeRawMemberRemoveEvent(member, self.guild.id))
+                if cached:
+                    await self.client.dispatch("member_remove", member)
+            elif spec["kind"] == "command":
+                interaction = FakeInteraction(self.client, user, self.general)
+                for cog in self.client.cogs.values():
+                    for command in cog.__cog_app_commands__:
+                        if command.name == spec["name"]:
+                            kwargs = {"msg": spec["content"]} if spec["name"] == "message" else {}
+                            await command.callback(cog, interaction, **kwargs)
+            elif spec["kind"] == "reload":
+                if spec.get("touch"):
+                    with open(os.path.join(*spec["touch"].split("/")), "a") as f:
+                        f.write("\n")
+                cog = self.client.get_cog("Commands")
+                interaction = FakeInteraction(self.client, user, self.general)
+                await cog.reload.callback(cog, interaction, app_commands.Choice(name="Cogs", value="cogs"))
+            else:
+                raise ValueError(f"Unknown event kind: {spec['kind']}")
+        except Exception as e:
+            event.error = f"{type(e).__name__}: {e}"
+        event.finished = time.perf_counter()
+
+    async def replay(self, traffic):
+        sampler = asyncio.create_task(self.sample_loop())
+        tasks = []
+        start = time.perf_counter()
+        for spec in traffic:
+            delay = start + spec.get("t", 0) - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.handle(spec)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - start
+        sampler.cancel()
+        return wall
+
+    def report(self, scenario, wall):
+        latencies = [(e.first_output or e.finished) - e.started for e in self.events]
+        replied = [e.first_output - e.started for e in self.events if e.first_output is not None]
+        errors = [e.error for e in self.events if e.error]
+        rss = [r for r in self.rss_samples if r is not None]
+        first_audio = [e.first_audio - e.started for e in self.events if e.first_audio is not None]
+        reloads = [e.finished - e.started for e in self.events if e.kind == "reload"]
+        # One message answers a whole batch of joins/leaves, so this is measured from each join/leave to the message greeting it
+        greetings = [e.greeted - e.started for e in self.events if e.greeted is not None]
+        return {
+            "scenario": scenario,
+            "events": len(self.events),
+            "wall_seconds": wall,
+            "messages_per_second": len(self.events) / wall if wall else None,
+            "reply_latency_p50": percentile(latencies, 50),
+            "reply_latency_p99": percentile(latencies, 99),
+            "replied": len(replied),
+            "errors": len(errors),
+            "first_errors": sorted(set(errors))[:5],
+            "greeted": len(greetings),
+            "greeting_latency_p50": percentile(greetings, 50),
+            "greeting_latency_p99": percentile(greetings, 99),
+            "time_to_first_audio_p50": percentile(first_audio, 50),
+            "time_to_first_audio_p99": percentile(first_audio, 99),
+            "audio_silence_frames": self.guild.voice_client.silence_frames if self.guild.voice_client else None,
+            "loop_lag_p50": percentile(self.loop_lag, 50),
+            "loop_lag_p99": percentile(self.loop_lag, 99),
+            "loop_lag_max": max(self.loop_lag, default=None),
+            "rss_mb_max": max(rss, default=None),
+            "peak_rss_mb": peak_rss_mb(),
+            "startup_seconds": self.startup_seconds,
+            "reload_seconds_max": max(reloads, default=None),
+            "gemini_requests": self.fake.requests,
+            "gemini_errors": self.fake.errors,
+            "input_tokens_uploaded_per_request": self.fake.uploaded_tokens / self.fake.text_requests if self.fake.text_requests else None,
+            "input_tokens_cached_per_request": self.fake.cached_tokens / self.fake.text_requests if self.fake.text_requests else None,
+        }
+
+def print_report(report, baseline=None):
+    print(f"\n----------------------- BENCHMARK: {report['scenario']} -----------------------")
+    for key, value in report.items():
+        if key in ("scenario", "first_errors"):
+            continue
+        line = f"{key:<34} {format_value(value)}"
+        if baseline and isinstance(value, (int, float)) and isinstance(baseline.get(key), (int, float)) and baseline[key]:
+            line += f"   ({(value - baseline[key]) / baseline[key] * 100:+.1f}% vs baseline {format_value(baseline[key])})"
+        print(line)
+    for error in report["first_errors"]:
+        print(f"error: {error}")
+
+def format_value(value):
+    if isinstance(value, float):
+        return f"{value:.4f}"
+    return str(value)
+
+async def run(args):
+    traffic = load_traffic(args.traffic) if args.traffic else synthetic_traffic(args.scenario, args.rate, args.duration, args.seed)
+    if args.save_traffic:
+        save_traffic(traffic, args.save_traffic)
+
+    fake = FakeGemini(args.latency_ms, args.jitter_ms, args.error_rate, args.tts_ms_per_char, args.cache_min_tokens, args.reply_sentences, seed=args.seed).start()
+    cwd = os.getcwd()
+    workdir = prepare_workdir(fake, args.history_limit, args.context_caching, args.tts_pipelining)
+    sys.path.insert(0, workdir)
+    os.chdir(workdir)
+    try:
+        output = sys.stdout if args.verbose else io.StringIO()
+        with contextlib.redirect_stdout(output):
+            bench = Bench(fake, args.guilds, args.seed)
+            await bench.load_cogs()
+            _, _, history_size, image_share = SCENARIOS.get(args.scenario, (None, None, 0, 0.0))
+            bench.seed_history(history_size, image_share)
+            wall = await bench.replay(traffic)
+        return bench.report(args.scenario if not args.traffic else os.path.basename(args.traffic), wall)
+    finally:
+        os.chdir(cwd)
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the bot's message pipeline.")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mention_storm")
+    parser.add_argument("--traffic", help="Replay a recorded JSONL traffic file instead of a synthetic scenario.")
+    parser.add_argument("--save-traffic", help="Write the generated traffic to a JSONL file for later replay.")
+    parser.add_argument("--rate", type=float, help="Target events per second (defaults to the scenario's rate).")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of synthetic traffic to generate.")
+    parser.add_argument("--guilds", type=int, default=1, help="Number of guilds the fake client is in.")
+    parser.add_argument("--history-limit", type=int, help="Override ai_message_history_limit.")
+    parser.add_argument("--latency-ms", type=float, default=800, help="Fake Gemini base latency.")
+    parser.add_argument("--jitter-ms", type=float, default=200, help="Fake Gemini latency jitter.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake Gemini requests that fail.")
+    parser.add_argument("--tts-ms-per-char", type=float, default=20, help="Extra fake TTS latency per character.")
+    parser.add_argument("--context-caching", action="store_true", help="Enable ai_studio_context_caching for the run.")
+    parser.add_argument("--cache-min-tokens", type=int, default=0, help="Smallest system prompt the fake server agrees to cache.")
+    parser.add_argument("--reply-sentences", type=int, default=4, help="Sentences in each fake Gemini text reply.")
+    parser.add_argument("--tts-pipelining", action="store_true", help="Enable tts_pipelining for the run.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON.")
+    parser.add_argument("--baseline", help="Compare against a previous JSON report.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the cogs' console output.")
+    args = parser.parse_args()
+
+    for name in ("traffic", "save_traffic", "output", "baseline"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+if __name__ == "__main__":
+    main()
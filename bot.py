@@ -6,8 +6,12 @@ import scripts.functions as functions
 
 def main():
     name = sys.argv[1]
+    # Optional shard range for this process, e.g. "0-3", used when the bot's shards are spread over several processes
+    shard_ids = functions.parse_shard_ids(sys.argv[2]) if len(sys.argv) > 2 else None
 
     keys = functions.load_json('Variables/keys')
+    variables = functions.load_json('Variables/general')
+    sharding = variables[name].get("sharding", {})
 
     intents = discord.Intents.default()
     intents.message_content = True
@@ -15,7 +19,21 @@ def main():
 
     contexts = discord.app_commands.AppCommandContext(guild=True, dm_channel=True, private_channel=True)
 
-    client = commands.Bot(command_prefix='/', intents=intents, allowed_contexts=contexts)
+    if variables[name].get("lazy_member_cache", False):
+        # Don't chunk every guild at startup, only keep members that are in voice (needed for the voice features) and fetch the rest on demand
+        member_cache_flags = discord.MemberCacheFlags.none()
+        member_cache_flags.voice = True
+        chunk_guilds_at_startup = False
+    else:
+        member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+        chunk_guilds_at_startup = True
+
+    if sharding.get("enabled", False):
+        if shard_ids is not None and sharding.get("shard_count") is None:
+            raise ValueError(f"A shard range was given for {name} but its \"shard_count\" is not set in general.json")
+        client = commands.AutoShardedBot(command_prefix='/', intents=intents, allowed_contexts=contexts, shard_count=sharding.get("shard_count"), shard_ids=shard_ids, member_cache_flags=member_cache_flags, chunk_guilds_at_startup=chunk_guilds_at_startup)
+    else:
+        client = commands.Bot(command_prefix='/', intents=intents, allowed_contexts=contexts, member_cache_flags=member_cache_flags, chunk_guilds_at_startup=chunk_guilds_at_startup)
     client.main_name = name
 
     @client.event
@@ -26,17 +44,24 @@ def main():
             if cog.endswith('.py'):
                 try:
                     await client.load_extension(f'cogs.{cog[:-3]}')
+                    functions.cog_hashes(client)[f'cogs.{cog[:-3]}'] = functions.extension_hash(client, f'cogs.{cog[:-3]}')
                     print (f"Loaded {cog}")
                 except Exception as e:
                     print(f'Failed to load extension {cog}: {e}')
         
-        try:
-            synced = await client.tree.sync()
-            if (len(synced) == 1): plural = ""
-            else: plural = 's'
-            print(f"Synced {len(synced)} command{plural}")
-        except Exception as e:
-            print(f"Failed to sync commands: {e}")
+        functions.cog_hashes(client)['scripts.functions'] = functions.extension_hash(client, 'scripts.functions')
+
+        # Commands are global, so only one process of a sharded bot needs to sync them
+        if getattr(client, 'shard_ids', None) is None or 0 in client.shard_ids:
+            try:
+                synced = await client.tree.sync()
+                if (len(synced) == 1): plural = ""
+                else: plural = 's'
+                print(f"Synced {len(synced)} command{plural}")
+            except Exception as e:
+                print(f"Failed to sync commands: {e}")
+
+        print("\n".join(functions.status_lines(client)))
 
     client.run(keys[name]["client_key"])
 
@@ -7,20 +7,41 @@ import scripts.functions as functions
 
 variables = functions.load_json("Variables/general")
 
-def run_script(bot_name):
+def run_script(bot_name, shard_range=None):
     if sys.platform == "win32":
         python_path = os.path.join("bot-env", "Scripts", "python.exe")
     else:
         python_path = os.path.join("bot-env", "bin", "python")
-    subprocess.run([python_path, "bot.py", bot_name])
+    args = [python_path, "bot.py", bot_name]
+    if shard_range:
+        args.append(shard_range)
+    subprocess.run(args)
+
+def shard_ranges(bot_name):
+    """Splits a sharded bot's shards into one contiguous range per process, or [None] to run it as a single process."""
+    sharding = variables[bot_name].get("sharding", {})
+    processes = sharding.get("processes", 1)
+    if not sharding.get("enabled", False) or processes <= 1:
+        return [None]
+    shard_count = sharding.get("shard_count")
+    if shard_count is None:
+        raise ValueError(f"{bot_name} is split over {processes} processes but its \"shard_count\" is not set in general.json")
+    ranges = []
+    for process in range(processes):
+        start = process * shard_count // processes
+        end = (process + 1) * shard_count // processes - 1
+        if end >= start:
+            ranges.append(f"{start}-{end}")
+    return ranges
 
 botThreads = []
 
 if __name__ == "__main__":
     for bot in variables["Bots"]:
-        botThread = threading.Thread(target=run_script, args=(bot,))
-        botThreads.append(botThread)
-        botThread.start()
+        for shard_range in shard_ranges(bot):
+            botThread = threading.Thread(target=run_script, args=(bot, shard_range))
+            botThreads.append(botThread)
+            botThread.start()
     
     for thread in botThreads:
         thread.join()
@@ -3,20 +3,24 @@ from discord import app_commands
 from discord.ext import commands
 from google import genai
 from google.genai import types # type: ignore
+from google.genai import errors # type: ignore
 import re
 from datetime import timedelta
 import asyncio
 import io
+import time
 import imageio_ffmpeg # type: ignore
 import scripts.functions as functions
 functions.reload(functions)
 
 
+json_files = ['Variables/keys', 'Variables/prompts', 'Variables/general']
 keys = functions.load_json('Variables/keys')
 prompts = functions.load_json('Variables/prompts')
 variables = functions.load_json('Variables/general')
 
-genai_client = genai.Client(api_key=keys["ai_studio_key"])
+# Shared with scripts/functions, which keeps it alive across cog reloads
+genai_client = functions.genai_client
 
 FFMPEG_PATH = imageio_ffmpeg.get_ffmpeg_exe()
 ffmpeg_options = {
@@ -27,6 +31,56 @@ ffmpeg_options = {
 class AI(commands.Cog):
     def __init__(self, client):
         self.client = client
+        # Welcome/goodbye state, keyed by (guild id, "welcome"/"goodbye") unless noted otherwise
+        self.pending_greetings = {}
+        self.greeting_pools = {}
+        self.greeting_refills = {}
+        # guild id -> time.monotonic() of the generations in the last minute / of the last join or leave
+        self.greeting_generations = {}
+        self.last_greeting_activity = {}
+
+    def export_state(self):
+        return {
+            "pending_greetings": self.pending_greetings,
+            "greeting_pools": self.greeting_pools,
+            "greeting_generations": self.greeting_generations,
+            "last_greeting_activity": self.last_greeting_activity,
+            "greeting_refills": [key for key, task in self.greeting_refills.items() if not task.done()],
+            "system_prompt_caches": system_prompt_caches,
+            "system_prompt_cache_failures": system_prompt_cache_failures,
+            "context_cache_stats": context_cache_stats,
+        }
+
+    async def cog_load(self):
+        state = functions.take_cog_state(self.client, self.qualified_name)
+        if state is not None:
+            # Reloaded, keep the previous instance's queues, pools and caches instead of starting cold
+            self.pending_greetings = state.get("pending_greetings", self.pending_greetings)
+            self.greeting_pools = state.get("greeting_pools", self.greeting_pools)
+            self.greeting_generations = state.get("greeting_generations", self.greeting_generations)
+            self.last_greeting_activity = state.get("last_greeting_activity", self.last_greeting_activity)
+            system_prompt_caches.update(state.get("system_prompt_caches", {}))
+            system_prompt_cache_failures.update(state.get("system_prompt_cache_failures", {}))
+            context_cache_stats.update(state.get("context_cache_stats", {}))
+            for guild_id, kind in state.get("greeting_refills", []):
+                guild = self.client.get_guild(guild_id)
+                if guild:
+                    self.schedule_greeting_refill(kind, guild)
+        elif variables.get("ai_studio_context_caching", False):
+            self.cache_warmup = asyncio.create_task(self.warm_system_prompt_caches())
+
+    async def cog_unload(self):
+        for task in self.greeting_refills.values():
+            task.cancel()
+
+    async def warm_system_prompt_caches(self):
+        system_prompt = prompts[self.client.main_name]["system_prompt"]
+        for prompt, modelIndex in [
+            (system_prompt, variables["default_ai_model_index"]),
+            (system_prompt + prompts["welcome_system_prompt"], variables["welcome_goodbye_model_index"]),
+            (system_prompt + prompts["goodbye_system_prompt"], variables["welcome_goodbye_model_index"]),
+        ]:
+            await get_system_prompt_cache(variables["models"]["ai_studio"][modelIndex], prompt)
 
     @app_commands.command(name="message", description="Activates the AI features through a command.")
     async def message(self, interaction: discord.Interaction, msg: str, img: discord.Attachment = None):
@@ -52,7 +106,9 @@ class AI(commands.Cog):
             if(config["Modules"]["Timeout"]):
                 if(re.search(r"!Timeout <@[0-9]+>", message.content)):
                     for string in re.findall(r"!Timeout <@[0-9]+>", message.content):
-                        member = message.guild.get_member(int(re.search(r"[0-9]+", string).group(0)))
+                        member_id = int(re.search(r"[0-9]+", string).group(0))
+                        # Not cached when the member cache is lazy
+                        member = message.guild.get_member(member_id) or await message.guild.fetch_member(member_id)
                         await member.timeout(timedelta(minutes=variables["timeout_duration_minutes"]), reason=variables["timeout_reason"])
             return
         if message.author.bot:
@@ -97,53 +153,157 @@ class AI(commands.Cog):
                     await functions.send_message(message, chunks)
 
                 if message.guild.voice_client is not None and message.author.voice is not None and message.author.voice.channel == message.guild.voice_client.channel and message.channel is message.guild.voice_client.channel:
+                    def make_source(data):
+                        return discord.FFmpegPCMAudio(io.BytesIO(data), executable=FFMPEG_PATH, pipe=True, **ffmpeg_options)
+                    def play(source):
+                        message.guild.voice_client.play(source, after=lambda e: message.reply(f"Player error: {e}", delete_after=10) if e else None)
                     try:
-                        data = await functions.generate_audio(output, functions.get_voice_prompt(self.client.user.id))
-                        audio_buffer = io.BytesIO(data)
-                        audio_buffer.seek(0)
-                        message.guild.voice_client.play(discord.FFmpegPCMAudio(audio_buffer, executable=FFMPEG_PATH, pipe=True, **ffmpeg_options), after=lambda e: message.reply(f"Player error: {e}", delete_after=10) if e else None)
+                        if variables.get("tts_pipelining", False):
+                            # Synthesize sentence by sentence and start playing as soon as the first one is ready
+                            time_to_first_audio = await functions.generate_audio_pipelined(output, functions.get_voice_prompt(self.client.user.id), play, make_source)
+                        else:
+                            start = time.perf_counter()
+                            data = await functions.generate_audio(output, functions.get_voice_prompt(self.client.user.id))
+                            play(make_source(data))
+                            time_to_first_audio = time.perf_counter() - start
+                        print(f"TTS ({'pipelined' if variables.get('tts_pipelining', False) else 'single request'}): {time_to_first_audio:.2f}s to first audio for {len(output)} characters")
                     except Exception as e:
                         await message.reply(f"Error: {e}", delete_after=10)
                         return
                     await message.reply(content="TTS complete.", delete_after=5)
         if(config["Modules"]["Welcome"]):
             if message.type == discord.MessageType.new_member:
-                async with message.channel.typing():
-                    prompt = f"New User ID: {message.author.id}\nNew User Name: {message.author.display_name}"
-                    print(f"\n--------------------- NEW MEMBER ---------------------\n{prompt}")
-                    if(variables["ai_provider"] == "ai_studio"):
-                        output = await aistudio_request(prompt, prompts[self.client.main_name]["system_prompt"] + prompts["welcome_system_prompt"], variables["welcome_goodbye_model_index"])
-                    chunks = await functions.chunkify(output)
-                    await functions.send_message(message, chunks)
+                await self.queue_greeting("welcome", message.guild, message.author, message)
 
     @commands.Cog.listener()
-    async def on_member_remove(self, member):
-        config = functions.load_json(f"config/{self.client.main_name}/{member.guild.id}")
+    async def on_raw_member_remove(self, payload):
+        # on_member_remove only fires for cached members, which with lazy_member_cache is almost nobody
+        guild = self.client.get_guild(payload.guild_id)
+        if guild is None:
+            return
+        config = functions.load_json(f"config/{self.client.main_name}/{guild.id}")
         if(config["Modules"]["Goodbye"]):
-            if member.guild.system_channel:
-                prompt = f"\nServer Name: {member.guild.name}\nUser that left ID: {member.id}\nUser that left name: {member.display_name}"
-                print(f"\n--------------------- MEMBER LEAVE ---------------------\n{prompt}")
-                if(variables["ai_provider"] == "ai_studio"):
-                    output = await aistudio_request(prompt, prompts[self.client.main_name]["system_prompt"] + prompts["goodbye_system_prompt"], variables["welcome_goodbye_model_index"])
-                await member.guild.system_channel.send(output)
+            if guild.system_channel:
+                await self.queue_greeting("goodbye", guild, payload.user)
+
+    async def queue_greeting(self, kind, guild, member, message = None):
+        """
+        Collects joins/leaves for a guild over the batch window and answers them with a single message
+        per "welcome_goodbye_batch_max_members" members.
+        The first call of a window waits for it to close and sends the batch, the rest just join it.
+        """
+        key = (guild.id, kind)
+        self.last_greeting_activity[guild.id] = time.monotonic()
+        if key in self.pending_greetings:
+            self.pending_greetings[key].append((member, message))
+            return
+        self.pending_greetings[key] = [(member, message)]
+        await asyncio.sleep(variables.get("welcome_goodbye_batch_window_seconds", 5))
+        batch = self.pending_greetings.pop(key)
+        # Big waves are split so every message stays under Discord's 2000 character limit
+        size = variables.get("welcome_goodbye_batch_max_members", 20)
+        for i in range(0, len(batch), size):
+            await self.send_greeting(kind, guild, batch[i:i + size])
+
+    async def send_greeting(self, kind, guild, batch):
+        # Pre-generated templates first, then a live generation if the guild's cap allows it, then the fallback template
+        members = [member for member, _ in batch]
+        pool = self.greeting_pools.setdefault((guild.id, kind), [])
+        if pool:
+            output = fill_greeting_template(pool.pop(0), members)
+        elif self.take_greeting_generation(guild.id):
+            if kind == "welcome":
+                async with batch[-1][1].channel.typing():
+                    output = await self.generate_greeting(kind, guild, [member.id for member in members], [member.display_name for member in members])
+            else:
+                output = await self.generate_greeting(kind, guild, [member.id for member in members], [member.display_name for member in members])
+        else:
+            print(f"\n--------------------- {kind.upper()} CAP ---------------------\nGeneration cap reached for {guild.name}, using fallback template")
+            output = fill_greeting_template(variables.get(f"{kind}_fallback_template", "NEW_USER_NAME"), members)
+        self.schedule_greeting_refill(kind, guild)
+
+        chunks = await functions.chunkify(output)
+        if kind == "welcome":
+            await functions.send_message(batch[-1][1], chunks)
+        elif guild.system_channel:
+            for chunk in chunks:
+                await guild.system_channel.send(chunk)
+
+    async def generate_greeting(self, kind, guild, ids, names, template = False):
+        ids = ", ".join(str(id) for id in ids)
+        names = ", ".join(names)
+        if kind == "welcome":
+            prompt = f"New User ID: {ids}\nNew User Name: {names}"
+            print(f"\n--------------------- NEW MEMBER ---------------------\n{prompt}")
+        else:
+            prompt = f"\nServer Name: {guild.name}\nUser that left ID: {ids}\nUser that left name: {names}"
+            print(f"\n--------------------- MEMBER LEAVE ---------------------\n{prompt}")
+        if template:
+            prompt += "\nThis message will be reused as a template: write NEW_USER_ID and NEW_USER_NAME exactly as they are, they will be replaced with the real values."
+        if(variables["ai_provider"] == "ai_studio"):
+            output = await aistudio_request(prompt, prompts[self.client.main_name]["system_prompt"] + prompts[f"{kind}_system_prompt"], variables["welcome_goodbye_model_index"])
+        return output
+
+    def take_greeting_generation(self, guild_id):
+        """Counts a welcome/goodbye generation against the guild's per minute cap, returns False if the cap is reached."""
+        now = time.monotonic()
+        generations = [t for t in self.greeting_generations.get(guild_id, []) if now - t < 60]
+        self.greeting_generations[guild_id] = generations
+        if len(generations) >= variables.get("welcome_goodbye_generations_per_minute", 10):
+            return False
+        generations.append(now)
+        return True
+
+    def schedule_greeting_refill(self, kind, guild):
+        task = self.greeting_refills.get((guild.id, kind))
+        if task is None or task.done():
+            self.greeting_refills[(guild.id, kind)] = asyncio.create_task(self.refill_greeting_pool(kind, guild))
+
+    async def refill_greeting_pool(self, kind, guild):
+        """Tops the guild's template pool up once it has had no joins/leaves for a while, within the generation cap."""
+        idle_seconds = variables.get("welcome_goodbye_pool_idle_seconds", 30)
+        pool = self.greeting_pools.setdefault((guild.id, kind), [])
+        while len(pool) < variables.get("welcome_goodbye_pool_size", 3):
+            idle = time.monotonic() - self.last_greeting_activity.get(guild.id, 0)
+            if idle < idle_seconds:
+                await asyncio.sleep(idle_seconds - idle)
+                continue
+            config = functions.load_json(f"config/{self.client.main_name}/{guild.id}")
+            if not config["Modules"][kind.capitalize()]:
+                return
+            if not self.take_greeting_generation(guild.id):
+                await asyncio.sleep(idle_seconds)
+                continue
+            template = await self.generate_greeting(kind, guild, ["NEW_USER_ID"], ["NEW_USER_NAME"], template = True)
+            if "NEW_USER_" not in template:
+                # Either the request failed or the model ignored the placeholders, try again after the next join/leave
+                print(f"\n--------------------- {kind.upper()} POOL ---------------------\nDiscarded template without placeholders: {template}")
+                return
+            pool.append(template)
+
+def fill_greeting_template(template, members):
+    template = template.replace("<@NEW_USER_ID>", ", ".join(f"<@{member.id}>" for member in members))
+    template = template.replace("NEW_USER_ID", ", ".join(str(member.id) for member in members))
+    return template.replace("NEW_USER_NAME", ", ".join(member.display_name for member in members))
 
 async def aistudio_request(prompt, system_prompt, modelIndex = variables["default_ai_model_index"]):
     try:
-        response = await asyncio.wait_for(
-            asyncio.to_thread(genai_client.models.generate_content,
-                model=variables["models"]["ai_studio"][modelIndex],
-                config=types.GenerateContentConfig(
-                    system_instruction=system_prompt,
-                    tools=[
-                        types.Tool(
-                            google_search = types.GoogleSearch()
-                        )
-                    ],
-                ),
-                contents = prompt
-            ),
-            timeout=180
-            )
+        model = variables["models"]["ai_studio"][modelIndex]
+        cached_content = await get_system_prompt_cache(model, system_prompt)
+        if cached_content:
+            try:
+                response = await generate_content(model, prompt, types.GenerateContentConfig(cached_content=cached_content))
+            except errors.ClientError as e:
+                # Rate limits, bad prompts, server errors and timeouts go to the usual next model fallback
+                if not is_missing_cache_error(e):
+                    raise
+                # The cache was evicted server side, create a new one on the next request
+                print(f"\n---------------------- CONTEXT CACHE ----------------------\n{cached_content} is no longer available, retrying without cache: {e}")
+                system_prompt_caches.pop((model, system_prompt), None)
+                response = await generate_content(model, prompt, types.GenerateContentConfig(system_instruction=system_prompt, tools=ai_tools()))
+        else:
+            response = await generate_content(model, prompt, types.GenerateContentConfig(system_instruction=system_prompt, tools=ai_tools()))
+        log_cache_usage(response)
         output = response.text
     except IndexError:
         print(f"\n------------------------- AI ERROR -------------------------\nError: No more models available to try after index {modelIndex}.")
@@ -163,5 +323,93 @@ async def aistudio_request(prompt, system_prompt, modelIndex = variables["defaul
     output = re.sub(r"(.|\n)*Message: ", "", output)
     return output
 
+def ai_tools():
+    return [
+        types.Tool(
+            google_search = types.GoogleSearch()
+        )
+    ]
+
+async def generate_content(model, prompt, config):
+    return await asyncio.wait_for(
+        asyncio.to_thread(genai_client.models.generate_content,
+            model=model,
+            config=config,
+            contents = prompt
+        ),
+        timeout=180
+        )
+
+# (model, system prompt) -> {"name": cached content name, "expires": time.monotonic() deadline}
+system_prompt_caches = {}
+# (model, system prompt) -> time.monotonic() after which creating a cache is attempted again
+system_prompt_cache_failures = {}
+system_prompt_cache_locks = {}
+context_cache_stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+async def get_system_prompt_cache(model, system_prompt):
+    """
+    Returns the name of a cached content holding system_prompt (and the tools) for model,
+    creating it on first use and extending its TTL once less than a quarter of it remains.
+    Returns None when context caching is off or the model/prompt can't be cached,
+    in which case the prompt should be sent inline as before.
+    """
+    if not variables.get("ai_studio_context_caching", False):
+        return None
+    key = (model, system_prompt)
+    if system_prompt_cache_failures.get(key, 0) > time.monotonic():
+        return None
+    ttl = variables.get("context_cache_ttl_seconds", 3600)
+
+    lock = system_prompt_cache_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        cache = system_prompt_caches.get(key)
+        remaining = cache["expires"] - time.monotonic() if cache else 0
+        if cache and remaining > ttl / 4:
+            return cache["name"]
+        # A stalled cache call would hold up every reply waiting on this lock, so it gets a short timeout
+        timeout = variables.get("context_cache_timeout_seconds", 10)
+        if cache and remaining > 0:
+            try:
+                await asyncio.wait_for(asyncio.to_thread(genai_client.caches.update, name=cache["name"], config=types.UpdateCachedContentConfig(ttl=f"{ttl}s")), timeout=timeout)
+                print(f"\n---------------------- CONTEXT CACHE ----------------------\nRefreshed {cache['name']} for {model}")
+                cache["expires"] = time.monotonic() + ttl
+                return cache["name"]
+            except Exception as e:
+                # Evicted early or the refresh failed, a new cache is created below
+                print(f"\n---------------------- CONTEXT CACHE ----------------------\nCould not refresh {cache['name']} for {model}, creating a new one: {type(e).__name__}: {e}")
+                system_prompt_caches.pop(key, None)
+        try:
+            created = await asyncio.wait_for(asyncio.to_thread(genai_client.caches.create, model=model, config=types.CreateCachedContentConfig(
+                system_instruction=system_prompt,
+                tools=ai_tools(),
+                ttl=f"{ttl}s",
+            )), timeout=timeout)
+            print(f"\n---------------------- CONTEXT CACHE ----------------------\nCreated {created.name} for {model}")
+            system_prompt_caches[key] = {"name": created.name, "expires": time.monotonic() + ttl}
+            return created.name
+        except Exception as e:
+            print(f"\n---------------------- CONTEXT CACHE ----------------------\nCould not cache system prompt for {model}, sending it inline: {type(e).__name__}: {e}")
+            system_prompt_caches.pop(key, None)
+            if isinstance(e, errors.ClientError) and e.code == 400:
+                # The model doesn't support caching or the prompt is under the minimum cacheable size, no point retrying soon
+                system_prompt_cache_failures[key] = time.monotonic() + ttl
+            else:
+                # Timeouts, rate limits, server and network errors are usually over quickly
+                system_prompt_cache_failures[key] = time.monotonic() + variables.get("context_cache_retry_seconds", 60)
+            return None
+
+def is_missing_cache_error(e):
+    return e.code in (403, 404) and "cache" in str(e.message).lower()
+
+def log_cache_usage(response):
+    usage = response.usage_metadata
+    if usage is None or not variables.get("ai_studio_context_caching", False):
+        return
+    context_cache_stats["requests"] += 1
+    context_cache_stats["prompt_tokens"] += usage.prompt_token_count or 0
+    context_cache_stats["cached_tokens"] += usage.cached_content_token_count or 0
+    print(f"Context cache: {usage.cached_content_token_count or 0} of {usage.prompt_token_count or 0} input tokens served from cache")
+
 async def setup(client):
     await client.add_cog(AI(client))
@@ -7,6 +7,7 @@ import shutil
 import scripts.functions as functions
 functions.reload(functions)
 
+json_files = ['Variables/general', 'config/default_config']
 variables = functions.load_json('Variables/general')
 default_config = functions.load_json('config/default_config')
 modules = []
@@ -40,22 +41,36 @@ class Commands(commands.Cog):
                 for cog_name in cogs_to_unload:
                     try:
                         await self.client.unload_extension(cog_name)
+                        functions.cog_hashes(self.client).pop(cog_name, None)
                         message_parts.append(f"Unloaded {cog_name.split('.')[-1]}.py")
                     except Exception as e:
                         message_parts.append(f'Failed to unload extension {cog_name.split(".")[-1]}.py: {e}')
 
-                # Cogs to load or reload (in filesystem)
+                # Every cog holds on to scripts/functions, so a change there (or to its JSON files) reloads all of them
+                cog_hashes = functions.cog_hashes(self.client)
+                functions_changed = cog_hashes.get('scripts.functions') != functions.extension_hash(self.client, 'scripts.functions')
+                unchanged = []
+
+                # Cogs to load or reload (in filesystem), skipping loaded cogs whose source and JSON files are unchanged
                 for cog_file in os.listdir('cogs'):
                     if cog_file.endswith('.py'):
                         cog_name = f'cogs.{cog_file[:-3]}'
                         try:
-                            await self.client.load_extension(cog_name)
-                            message_parts.append(f"Loaded {cog_file}")
-                        except commands.ExtensionAlreadyLoaded:
-                            await self.client.reload_extension(cog_name)
-                            message_parts.append(f"Reloaded {cog_file}")
+                            if cog_name not in loaded_cogs:
+                                await self.client.load_extension(cog_name)
+                                message_parts.append(f"Loaded {cog_file}")
+                            elif functions_changed or cog_hashes.get(cog_name) != functions.extension_hash(self.client, cog_name):
+                                functions.export_cog_states(self.client, cog_name)
+                                await self.client.reload_extension(cog_name)
+                                message_parts.append(f"Reloaded {cog_file}")
+                            else:
+                                unchanged.append(cog_file)
+                            cog_hashes[cog_name] = functions.extension_hash(self.client, cog_name)
                         except Exception as e:
                             message_parts.append(f'Failed to load/reload extension {cog_file}: {e}')
+                cog_hashes['scripts.functions'] = functions.extension_hash(self.client, 'scripts.functions')
+                if unchanged:
+                    message_parts.append(f"Unchanged: {', '.join(unchanged)}")
                 await interaction.response.send_message(f"Cogs processed:\n" + "\n".join(message_parts), ephemeral=True)
             except Exception as e:
                 await interaction.response.send_message(f"Cogs failed to reload:{e}", ephemeral=True)
@@ -70,6 +85,11 @@ class Commands(commands.Cog):
         else:
             await interaction.response.send_message(f"Part not recognised", ephemeral=True)
 
+    @app_commands.command(name="status", description="Shows per shard latency, guild counts and memory. Can only be used by the bot's owner.")
+    @app_commands.check(is_owner)
+    async def status(self, interaction: discord.Interaction):
+        await interaction.response.send_message("\n".join(functions.status_lines(self.client)), ephemeral=True)
+
     config = app_commands.Group(
         name='config', 
         description='Configuration commands', 
@@ -213,8 +233,9 @@ class Commands(commands.Cog):
         # Admin/Owner Commands
         embed.add_field(name="Moderation & Bot Management (Restricted)", value="---", inline=False)
         embed.add_field(name="/config modules `<module>` `<value>`", value="Enable or disable bot modules (Admin only).", inline=True)
-        embed.add_field(name="/reload `<part>`", value="Reloads bot cogs or commands (Owner only).", inline=True)
+        embed.add_field(name="/reload `<part>`", value="Reloads the bot cogs whose code or JSON settings/prompts changed, or syncs commands (Owner only).", inline=True)
         embed.add_field(name="/update", value="Pulls the latest code and updates dependencies (Owner only).", inline=True)
+        embed.add_field(name="/status", value="Shows per shard latency, guild counts and memory (Owner only).", inline=True)
 
         embed.set_footer(text="Use commands by typing '/' in the chat.")
         await interaction.response.send_message(embed=embed, ephemeral=True)
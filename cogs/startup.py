@@ -5,10 +5,23 @@ import shutil
 import scripts.functions as functions
 functions.reload(functions)
 
+# Only loaded in cog_load, listed so /reload re-runs the reconciliation when the defaults change
+json_files = ["config/default_config", "config/default_voice"]
+
 class startup(commands.Cog):
     def __init__(self, client):
         self.client = client
+        self.defaults_hash = None
+
+    def export_state(self):
+        # Tells the new instance which defaults the guild configs were already reconciled with
+        return {"defaults_hash": self.defaults_hash}
 
+    async def cog_load(self):
+        state = functions.take_cog_state(self.client, self.qualified_name)
+        self.defaults_hash = defaults_hash()
+        if state is not None and state.get("defaults_hash") == self.defaults_hash:
+            return
 
         for guild in self.client.guilds:
             if not f"{str(guild.id)}.json" in os.listdir(os.path.join("config", self.client.main_name)):
@@ -20,7 +33,7 @@ class startup(commands.Cog):
         for file in os.listdir(os.path.join("config", self.client.main_name)):
             if file.endswith(".json"):
                 full_config_file_path = os.path.join("config", self.client.main_name, file)
-                if file not in current_guild_files:
+                if file not in current_guild_files and functions.owns_guild(self.client, int(file.removesuffix(".json"))):
                     os.remove(full_config_file_path)
 
         def refresh_files(default_config, config_dir):
@@ -73,5 +86,8 @@ class startup(commands.Cog):
         if(os.path.exists(os.path.join("config", self.client.main_name, f"{str(guild.id)}.json"))):
             os.remove(os.path.join("config", self.client.main_name, f"{str(guild.id)}.json"))
 
+def defaults_hash():
+    return functions.source_hash(__file__, json_files)
+
 async def setup(client):
     await client.add_cog(startup(client))
\ No newline at end of file
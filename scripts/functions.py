@@ -1,17 +1,69 @@
 import json
 import discord
 import importlib
+import hashlib
 from PIL import Image
 import requests
 from io import BytesIO
 import asyncio
 import re
 import os
+import sys
+import threading
+import time
 from google import genai
 from google.genai import types # type: ignore
 
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# JSON files this module loads at import time, a change to any of them re-runs it on reload
+json_files = ["Variables/general", "Variables/keys"]
+
 def reload(module):
+    # Only re-run modules whose source or JSON files changed, so reloading a cog keeps the existing clients
+    digest = source_hash(module.__file__, getattr(module, "json_files", []))
+    if getattr(module, "__source_hash__", None) == digest:
+        return
     importlib.reload(module)
+    module.__source_hash__ = digest
+
+def source_hash(filepath, json_files=()):
+    """Hash of a Python file together with the JSON files (paths as given to load_json) it depends on."""
+    digest = hashlib.sha256()
+    for path in [filepath, *(f'{os.path.join(*file.split("/"))}.json' for file in json_files)]:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def extension_hash(client, name):
+    """source_hash() of a loaded cog ("cogs.AI") or of "scripts.functions", including the JSON files it loads."""
+    module = sys.modules.get(name) if name == "scripts.functions" else client.extensions.get(name)
+    return source_hash(os.path.join(*name.split(".")) + ".py", getattr(module, "json_files", []))
+
+def cog_hashes(client):
+    """extension_hash() of the loaded cogs (and scripts.functions) as of their last load, used by /reload to skip unchanged cogs."""
+    if not hasattr(client, "cog_hashes"):
+        client.cog_hashes = {}
+    return client.cog_hashes
+
+def export_cog_states(client, extension):
+    """
+    Collects the state of every cog in an extension that is about to be reloaded.
+    Cogs opt in by defining export_state(), returning whatever should survive the reload
+    (clients, caches, queues...), and get it back in their new instance through take_cog_state().
+    """
+    if not hasattr(client, "cog_states"):
+        client.cog_states = {}
+    for cog in client.cogs.values():
+        if cog.__module__ == extension and hasattr(cog, "export_state"):
+            client.cog_states[cog.qualified_name] = cog.export_state()
+
+def take_cog_state(client, name):
+    """Returns the state handed over by the previous instance of the cog, or None on a fresh load."""
+    return getattr(client, "cog_states", {}).pop(name, None)
 
 def load_json(filepath):
     filepath = f'{os.path.join(*filepath.split("/"))}.json'
@@ -102,7 +154,18 @@ async def send_message(message, chunks):
         await message.channel.send(chunk)
 
 keys = load_json('Variables/keys')
-genai_client = genai.Client(api_key=keys["ai_studio_key"])
+
+def create_genai_client():
+    # "ai_studio_base_url" is optional and only needed to point the bot at a different endpoint (e.g. the benchmark's fake server)
+    base_url = variables.get("ai_studio_base_url")
+    http_options = types.HttpOptions(base_url=base_url) if base_url else None
+    return genai.Client(api_key=keys["ai_studio_key"], http_options=http_options)
+
+# Reloading with the same key and endpoint keeps the existing client (and its open connections)
+genai_client_options = (keys["ai_studio_key"], variables.get("ai_studio_base_url"))
+if globals().get("genai_client_built_with") != genai_client_options:
+    genai_client = create_genai_client()
+    genai_client_built_with = genai_client_options
 
 async def generate_audio(message, config):
     voice_prompt = config["voice_prompt"]
@@ -124,6 +187,131 @@ async def generate_audio(message, config):
     response = await asyncio.wait_for(asyncio.to_thread(_blocking_generate_audio), timeout=180)
     return response.candidates[0].content.parts[0].inline_data.data
 
+def split_sentences(message, min_length):
+    """Splits text into sentences, merging short ones so every segment but the last has at least min_length characters."""
+    segments = []
+    current = ""
+    for sentence in re.split(r"(?<=[.!?])\s+", message.strip()):
+        current = f"{current} {sentence}" if current else sentence
+        if len(current) >= min_length:
+            segments.append(current)
+            current = ""
+    if current:
+        segments.append(current)
+    return segments
+
+class PipelinedAudioSource(discord.AudioSource):
+    """
+    Plays segments that are synthesized out of order, in order, as one audio source.
+    Each segment gets its own source from make_source(pcm), and the next one is started while
+    the current one plays, so there is no gap between segments. While the next segment is still
+    being synthesized it returns silence frames instead of blocking, so the player keeps its timing
+    (a blocking read makes it rush through the late frames afterwards).
+    read() and cleanup() run on the player's thread, put() on the event loop.
+    """
+    SILENCE = b"\x00" * discord.opus.Encoder.FRAME_SIZE
+
+    def __init__(self, count, make_source):
+        self.segments = [None] * count
+        self.make_source = make_source
+        self.index = 0
+        self.current = None
+        self.upcoming = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def put(self, index, data):
+        with self.lock:
+            self.segments[index] = data
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+
+    def _source_for(self, index):
+        # None while the segment is pending, False if it failed (synthesized as b"")
+        with self.lock:
+            data = self.segments[index]
+            if data is None:
+                return None
+            self.segments[index] = b""
+        return self.make_source(data) if data else False
+
+    def read(self):
+        while not self.closed and self.index < len(self.segments):
+            if self.current is None:
+                if self.upcoming is not None:
+                    self.current, self.upcoming = self.upcoming, None
+                else:
+                    self.current = self._source_for(self.index)
+                if self.current is None:
+                    return self.SILENCE
+                if self.current is False:
+                    self.current = None
+                    self.index += 1
+                    continue
+            if self.upcoming is None and self.index + 1 < len(self.segments):
+                self.upcoming = self._source_for(self.index + 1)
+            frame = self.current.read()
+            if frame:
+                return frame
+            self.current.cleanup()
+            self.current = None
+            self.index += 1
+            if self.upcoming is False:
+                self.upcoming = None
+                self.index += 1
+        return b""
+
+    def cleanup(self):
+        self.close()
+        for source in (self.current, self.upcoming):
+            if source:
+                source.cleanup()
+        self.current = None
+        self.upcoming = None
+
+async def generate_audio_pipelined(message, config, play, make_source):
+    """
+    Synthesizes message sentence by sentence, at most "tts_pipeline_parallelism" at a time,
+    and calls play(source) with a PipelinedAudioSource as soon as the first sentence is ready.
+    make_source(pcm) turns one sentence's PCM into an audio source. The rest is played in order
+    as it arrives. Failed sentences are skipped, and the first error is raised once every
+    sentence is done. Returns the time to first audio in seconds.
+    """
+    segments = split_sentences(message, variables.get("tts_segment_min_chars", 100)) or [message]
+    stream = PipelinedAudioSource(len(segments), make_source)
+    semaphore = asyncio.Semaphore(variables.get("tts_pipeline_parallelism", 3))
+    first_segment = asyncio.Event()
+    start = time.perf_counter()
+
+    async def synthesize(index, segment):
+        try:
+            async with semaphore:
+                stream.put(index, await generate_audio(segment, config))
+        except BaseException:
+            stream.put(index, b"")
+            raise
+        finally:
+            if index == 0:
+                first_segment.set()
+
+    tasks = [asyncio.create_task(synthesize(index, segment)) for index, segment in enumerate(segments)]
+    try:
+        await first_segment.wait()
+        play(stream)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        stream.close()
+        raise
+    time_to_first_audio = time.perf_counter() - start
+
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, BaseException):
+            raise result
+    return time_to_first_audio
+
 def get_voice_prompt(id):
     if f"{str(id)}.json" in os.listdir(os.path.join("config", "voice")):
         path = f"config/voice/{str(id)}"
@@ -138,5 +326,54 @@ def voices(num):
     }
     return switcher.get(num, "Zephyr")
 
+def parse_shard_ids(text):
+    """Turns a shard range from the command line ("0-3" or "0,2,4") into a list of shard ids."""
+    shard_ids = []
+    for part in text.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            shard_ids.extend(range(int(start), int(end) + 1))
+        else:
+            shard_ids.append(int(part))
+    return shard_ids
+
+def owns_guild(client, guild_id):
+    # When the shards are spread over several processes, each one only handles the guilds of its own shards
+    shard_ids = getattr(client, "shard_ids", None)
+    if not shard_ids:
+        return True
+    return (guild_id >> 22) % client.shard_count in shard_ids
+
+def process_memory_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # No /proc outside Linux, fall back to the peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def shard_status(client):
+    """Returns (shard id, latency in ms, guild count, cached member count) for every shard this process runs."""
+    latencies = getattr(client, "latencies", None) or [(0, client.latency)]
+    status = []
+    for shard_id, latency in latencies:
+        guilds = [guild for guild in client.guilds if guild.shard_id == shard_id]
+        status.append((shard_id, latency * 1000, len(guilds), sum(len(guild.members) for guild in guilds)))
+    return status
+
+def status_lines(client):
+    lines = [f"Shard {shard_id}: {latency:.0f}ms latency, {guilds} guilds, {members} cached members" for shard_id, latency, guilds, members in shard_status(client)]
+    memory = process_memory_mb()
+    lines.append(f"Memory: {memory:.1f} MB" if memory is not None else "Memory: unavailable")
+    return lines
+
 def image(url):
     return Image.open(BytesIO(requests.get(url).content))
+
+__source_hash__ = source_hash(__file__, json_files)